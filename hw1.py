@@ -6,62 +6,126 @@ import gzip
 import ssl
 # End of Allowed Modules
 
+BUFFER_SIZE = 128 * 1024 #read size per recv call, bigger reads means fewer syscalls
+SOCKET_RCVBUF = 1 << 20 #kernel receive buffer, so a single recv has enough data waiting
+MAX_REDIRECTS = 10
+PIPELINE_TIMEOUT = 2.0 #seconds to wait for a pipelined answer from a server that answered the first request within this time
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+PIPELINING_CACHE_SIZE = 256
+_NO_PIPELINING = set() #(scheme, host, port) of servers that dropped or didn't answer a pipelined request
+
+#created once, loading the CA certificates on every request is slow and a shared context can resume TLS sessions
+_SSL_CTX = ssl.create_default_context()
+_TLS_SESSIONS = {} #last TLS session per (scheme, host, port), resuming it skips most of the next handshake
+TLS_SESSION_CACHE_SIZE = 256
+
+#lets the kernel put the first data (our request or the ClientHello) into the SYN, the constant is missing on older Pythons
+TCP_FASTOPEN_CONNECT = getattr(socket, "TCP_FASTOPEN_CONNECT", 30 if sys.platform.startswith("linux") else None)
+
+#Linux only, acks incoming data right away, the kernel clears it again by itself so it is re-armed after every receive
+TCP_QUICKACK = getattr(socket, "TCP_QUICKACK", None)
+
+#hostnames already converted with IDNA, redirects and repeated fetches usually hit the same host
+IDNA_CACHE_SIZE = 256
+_IDNA_CACHE = {}
+
+#fixed parts of every GET request
+_REQUEST_HOST = b" HTTP/1.1\r\nHost: "
+_REQUEST_TAIL = b"\r\nUser-Agent: BarebonesHTTP/1.1\r\nConnection: keep-alive\r\n\r\n"
+
+#parts of a page that change on every request, they are removed with their values before comparing
+DYNAMIC_KEYS = (b"session_id=", b"timestamp=")
+VALUE_DELIMITERS = b"&;,\"' \t\r\n<>"
+DELIMITER_TABLE = bytes.maketrans(VALUE_DELIMITERS, b"\n" * len(VALUE_DELIMITERS))
+
 def retrieve_url(url):
+    conn = None
+    probe_conn = None
     try:
-        #checking if the url starts with https or http
-        if url[:7] == "http://":
-            scheme = "http"
-            url = url[7:]
-        elif url[:8] == "https://":
-            scheme = "https"
-            url = url[8:]
-        else:
-            raise ValueError("Invalid URL: Must start with 'http://' or 'https://'")
+        scheme, host, port, path = parse_url(url)
+
+        #following redirects in a loop, the probe request is only compared for the final resource
+        for hop in range(MAX_REDIRECTS + 1):
+            #both requests share one keep-alive connection, which is also kept when a redirect stays on the same server
+            if conn is None or not conn.reusable or conn.address != (scheme, host, port):
+                if conn is not None:
+                    conn.close()
+                conn = open_connection(host, port, scheme)
+
+            #pipelining the two GETs back to back, so both responses come back in about one round trip,
+            #but not on redirect targets (they may redirect again) or servers that dropped a pipelined request before
+            request = build_request(host, path, port, scheme)
+            pipelined = hop == 0 and conn.address not in _NO_PIPELINING
+            conn.sock.sendall(request + request if pipelined else request)
+
+            # reading the first HTTP response
+            head = read_first_head(conn)
+            if head is None:
+                logging.debug(f"Request to {url} returned no response.")
+                return None
+            status_code, headers = head
 
-        #extracting the host and optional port
-        path_start = url.find('/')
-        if path_start != -1:
-            host = url[:path_start]
-            path = url[path_start:]
-        else:
-            host = url
-            path = '/'  
-
-        colon_pos = host.rfind(':')
-        if colon_pos != -1:
-            port_str = host[colon_pos + 1:]
-            host = host[:colon_pos]
-            try:
-                port = int(port_str)
-            except ValueError:
-                logging.error(f"Invalid port number: {port_str}")
+            #the server won't answer the pipelined probe, so it goes out on a second connection while this body downloads
+            if status_code == 200 and not conn.reusable:
+                probe_conn = open_connection(host, port, scheme)
+                probe_conn.sock.sendall(request)
+
+            result = read_response(conn, head)
+            if result is None:
                 return None
-        else:
-            # No port specified, use default based on scheme
-            port = 443 if scheme == "https" else 80
+            response = result[2]
+            if status_code not in REDIRECT_CODES:
+                break
 
-        #for internationalized domain names (IDNA)
-        try:
-            host = host.encode('idna').decode('ascii')  # Handle non-ASCII characters in hostnames
-        except UnicodeError:
-            logging.error(f"Failed to encode hostname {host} using IDNA.")
+            location = headers.get(b"location")
+            if location is None:
+                logging.error(f"Redirect {status_code} without a Location header.")
+                return None
+            new_url = resolve_location(location.decode(), scheme, host, port, path)
+            logging.info(f"Redirecting to {new_url}")
+            new_scheme, new_host, new_port, path = parse_url(new_url)
+
+            #the pipelined probe answer for the old URL is skipped when the connection stays in use
+            if pipelined and conn.reusable and conn.address == (new_scheme, new_host, new_port):
+                if read_pipelined_response(conn) is None:
+                    mark_no_pipelining(conn.address)
+            scheme, host, port = new_scheme, new_host, new_port
+        else:
+            logging.error(f"Too many redirects for {url}")
             return None
 
-        # making the first HTTP request
-        response = get_http(host, path, port, scheme)
+        response = check_status(status_code, response)
         if response is None:
-            logging.debug(f"Request to {url} returned no response.")
             return None
 
-        # making a second request
-        second_response = get_http(host, path, port, scheme)
+        # reading the second response from the probe connection or the same connection, or asking for it now
+        second_response = None
+        if probe_conn is not None:
+            conn.close()
+            conn, probe_conn = probe_conn, None
+            result = read_response(conn) #sent alone on its own connection, so no pipelining time limit
+            if result is not None:
+                second_response = check_status(result[0], result[2])
+        elif pipelined:
+            if conn.reusable:
+                result = read_pipelined_response(conn)
+                if result is not None:
+                    second_response = check_status(result[0], result[2])
+            if second_response is None and not conn.reusable:
+                mark_no_pipelining(conn.address)
+        elif conn.reusable:
+            #the probe wasn't pipelined behind a redirect target, so it goes out now on the same connection
+            second_response = get_http(host, path, port, scheme, conn)
+        if second_response is None and not conn.reusable:
+            #the server closed the connection or never answered the pipelined request, so asking again
+            conn.close()
+            conn = open_connection(host, port, scheme)
+            second_response = get_http(host, path, port, scheme, conn)
         if second_response is None:
             return None
-        
-        cleaned_response = clean_response(response)
-        cleaned_second_response = clean_response(second_response)
+
         #if responses are different, then page is dynamic
-        if cleaned_response != cleaned_second_response:
+        if fingerprint(response) != fingerprint(second_response):
             logging.info("Dynamic content detected.")
             return None
 
@@ -75,116 +139,488 @@ def retrieve_url(url):
     except Exception as e:
         logging.error(f"Unhandled exception: {e}")
         return None
+    finally:
+        if conn is not None:
+            conn.close()
+        if probe_conn is not None:
+            probe_conn.close()
+
+
+def mark_no_pipelining(address):#remembers a server that didn't answer a pipelined request, it only gets single requests from now on
+    if len(_NO_PIPELINING) >= PIPELINING_CACHE_SIZE:
+        _NO_PIPELINING.clear()
+    _NO_PIPELINING.add(address)
+
+
+def parse_url(url):#splits the url into scheme, host, port and path, raises ValueError if it can't
+    #checking if the url starts with https or http
+    scheme, sep, rest = url.partition("://")
+    scheme = scheme.lower()
+    if not sep or scheme not in ("http", "https"):
+        raise ValueError("Invalid URL: Must start with 'http://' or 'https://'")
+
+    #the host part ends at the first '/', '?' or '#', everything after it except the fragment is the path
+    end = len(rest)
+    for delimiter in "/?#":
+        pos = rest.find(delimiter, 0, end)
+        if pos != -1:
+            end = pos
+    authority = rest[:end]
+    path = rest[end:].partition("#")[0]
+    if not path.startswith("/"):
+        path = "/" + path
+
+    #extracting the host and optional port, skipping any user info
+    host_port = authority.rpartition("@")[2]
+    if host_port.startswith("["): #IPv6 literal like [::1]:8080
+        host, _, port_str = host_port[1:].partition("]")
+        if port_str and not port_str.startswith(":"):
+            raise ValueError(f"Invalid IPv6 host: {host_port}")
+        port_str = port_str[1:]
+    else:
+        host, _, port_str = host_port.partition(":")
+    if not host:
+        raise ValueError(f"Invalid URL: Missing host in {url}")
+
+    if port_str:
+        if not port_str.isdigit():
+            raise ValueError(f"Invalid port number: {port_str}")
+        port = int(port_str)
+    else:
+        # No port specified, use default based on scheme
+        port = 443 if scheme == "https" else 80
+
+    #for internationalized domain names (IDNA)
+    if ":" not in host:
+        host = encode_host(host)
+
+    return scheme, host, port, path
+
+
+def encode_host(host):#IDNA-encodes a hostname, plain ASCII names are returned as they are and the rest are cached
+    if host.isascii():
+        return host
+    encoded = _IDNA_CACHE.get(host)
+    if encoded is None:
+        try:
+            encoded = host.encode('idna').decode('ascii')  # Handle non-ASCII characters in hostnames
+        except UnicodeError:
+            raise ValueError(f"Failed to encode hostname {host} using IDNA.")
+        if len(_IDNA_CACHE) >= IDNA_CACHE_SIZE:
+            _IDNA_CACHE.clear()
+        _IDNA_CACHE[host] = encoded
+    return encoded
+
+
+def resolve_location(location, scheme, host, port, path):#turns the Location header into a full url
+    if location[:8].lower().startswith(("http://", "https://")):
+        return location
+    if location.startswith("//"):
+        return f"{scheme}:{location}"
+    if location.startswith("?"):
+        location = path.partition("?")[0] + location
+    elif not location.startswith("/"):
+        directory = path.partition("?")[0]
+        location = directory[:directory.rfind("/") + 1] + location #relative to the current directory
+    authority = f"[{host}]" if ":" in host else host
+    return f"{scheme}://{authority}:{port}{location}"
+
+
+def open_connection(host, port, scheme):#opens the TCP (and TLS) connection and wraps it in a buffered reader
+    #trying every resolved address in turn, a host may list IPv6 first but only listen on IPv4
+    error = OSError(f"No addresses found for {host}")
+    addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for i, (family, _, _, _, address) in enumerate(addresses):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF) #has to be set before connect
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #our requests are tiny, Nagle would only hold them back
+            #with a cached cookie the kernel delays the SYN until the first send, so a refused address would only fail after this loop,
+            #over TLS the handshake happens in connect below, without it Fast Open is only used on the last address to try
+            if TCP_FASTOPEN_CONNECT is not None and (scheme == "https" or i == len(addresses) - 1):
+                try:
+                    sock.setsockopt(socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT, 1)
+                except OSError:
+                    pass #kernel without TCP Fast Open, a normal connect is fine
+            if scheme == "https":
+                session = _TLS_SESSIONS.get((scheme, host, port))
+                sock = _SSL_CTX.wrap_socket(sock, server_hostname=host, session=session)
+
+            logging.debug(f"Connecting to {host} at {address[0]} on port {port}...")
+            sock.connect(address)
+        except ssl.SSLError:
+            sock.close()
+            raise #the server was reached, another address won't fix a TLS problem
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        break
+    else:
+        raise error
+    return SocketReader(sock, (scheme, host, port))
+
+
+def build_request(host, path, port, scheme):#returns the encoded GET request for the path
+    host_header = f"[{host}]" if ":" in host else host #IPv6 literals keep their brackets
+    if (scheme == "http" and port != 80) or (scheme == "https" and port != 443):
+        host_header = f"{host_header}:{port}"
+
+    #only the path and Host header change between requests, the rest is prebuilt bytes
+    request = b"".join((b"GET ", path.encode(), _REQUEST_HOST, host_header.encode(), _REQUEST_TAIL))
+    logging.debug("Sending request: %r", request)
+    return request
+
+
+def get_http(host, path, port, scheme, conn=None):#sends a single GET and returns the body of a 200 response
+    own_conn = conn is None
+    try:
+        #establishing a socket connection, unless the caller passed one to reuse
+        if own_conn:
+            conn = open_connection(host, port, scheme)
 
+        #sending the HTTP GET request
+        conn.sock.sendall(build_request(host, path, port, scheme))
+        result = read_response(conn)
+        if result is None:
+            return None
+        return check_status(result[0], result[2])
+    except Exception as e:
+        if conn is not None:
+            conn.reusable = False
+        logging.error(f"Socket connection failed: {e}")
+        return None
+    finally:
+        if own_conn and conn is not None:
+            conn.close()
 
-def get_http(host, path, port, scheme):
-    try:
-        #establishing a socket connection
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        if scheme == "https":
-            context = ssl.create_default_context()
-            sock = context.wrap_socket(sock, server_hostname=host)
 
-        logging.debug(f"Connecting to {host} on port {port}...")
-        sock.connect((host, port))
+def read_head(conn):#reads the status line and headers of the next response, returns (status code, headers) or None
+    #receiving the HTTP response, headers first so the body can be read according to them
+    raw_headers = conn.read_until(b"\r\n\r\n")
+    if raw_headers is None:
+        conn.reusable = False
+        logging.error("Connection closed before the headers were received.")
+        return None
+    if logging.getLogger().isEnabledFor(logging.DEBUG): #decoding the headers only when they will actually be printed
+        logging.debug(f"Received headers:\n{raw_headers.decode(errors='replace')}")
 
-        if (scheme == "http" and port != 80) or (scheme == "https" and port != 443):
-            host_header = f"{host}:{port}"
-        else:
-            host_header = host
+    #to check for HTTP status code and the headers we care about
+    status_code, headers = parse_headers(raw_headers)
 
-        #sending the HTTP GET request
-        request = f"GET {path} HTTP/1.1\r\n"
-        request += f"Host: {host_header}\r\n"  # Add port in Host header if non-standard
-        request += "User-Agent: BarebonesHTTP/1.1\r\n"
-        request += "Connection: close\r\n\r\n"
-        logging.debug(f"Sending request: {request.strip()}")
-        sock.sendall(request.encode())
-
-        #receiving the HTTP response
-        response = b""
-        while True:
-            chunk = sock.recv(4096)
-            if not chunk:
-                break
-            response += chunk
+    if headers.get(b"connection", b"").lower() == b"close":
+        conn.reusable = False
+    return status_code, headers
 
-        sock.close()
 
-        headers, _, body = response.partition(b"\r\n\r\n")
-        logging.debug(f"Received headers:\n{headers.decode(errors='replace')}")
+def read_response(conn, head=None):#reads the next response (or its body if read_head was already called), returns (status code, headers, body) or None
+    try:
+        if head is None:
+            head = read_head(conn)
+            if head is None:
+                return None
+        status_code, headers = head
+
+        #reading the body for every status, so the next response on this connection starts in the right place
+        if status_code in (204, 304) or status_code < 200:
+            body = b"" #these responses never carry a body
+        elif status_code == 200 and b"gzip" in headers.get(b"content-encoding", b"").lower():
+            #decompressing while the body arrives, so the whole compressed body is never held in memory
+            stream = BodyStream(conn, headers)
+            body = gzip.GzipFile(fileobj=stream).read()
+            stream.drain()
+        else:
+            body = read_body(conn, headers)
 
-        #to check for HTTP status code
-        status_line = headers.split(b"\r\n")[0].decode()
-        status_code = int(status_line.split()[1])
+        return status_code, headers, body
+    except Exception as e:
+        conn.reusable = False
+        logging.error(f"Socket connection failed: {e}")
+        return None
 
-        #to handle non-200 status codes (e.g., 301, 302, 404)
-        if status_code == 404:
-            logging.error(f"404 Not Found: {status_line}")
-            return None
 
-        #to handle redirects (301, 302)
-        if status_code in (301, 302):
-            for line in headers.split(b"\r\n"):
-                if line.startswith(b"Location:"):
-                    new_url = line.split(b"Location:")[1].strip().decode()
-                    if not new_url.startswith("http"):
-                        new_url = f"{scheme}://{host}{new_url}"
-                    logging.info(f"Redirecting to {new_url}")
-                    return retrieve_url(new_url)
-
-        if status_code != 200:
-            logging.error(f"Received non-200 status code: {status_code}")
-            return None
+def read_first_head(conn):#like read_head, but also notes on the connection whether the server took longer than PIPELINE_TIMEOUT
+    conn.sock.settimeout(PIPELINE_TIMEOUT)
+    try:
+        return read_head(conn)
+    except socket.timeout:
+        conn.slow = True #nothing is lost, the buffered part stays and reading just continues without a limit
+    finally:
+        conn.sock.settimeout(None)
+    return read_head(conn)
 
-        #trying to handle chunked encoding and gzip, if needed
-        if b"Transfer-Encoding: chunked" in headers:
-            body = process_chunked_body(body)
 
-        if b"Content-Encoding: gzip" in headers:
-            body = gzip.decompress(body)
+def read_pipelined_response(conn):#like read_response, but gives up if a quick server stays silent instead of answering
+    if conn.slow:
+        #a slow first answer means the second one is probably just slow too, so there is no time limit
+        return read_response(conn)
 
-        return body
+    #some servers drop pipelined requests without closing, so the headers get a time limit
+    conn.sock.settimeout(PIPELINE_TIMEOUT)
+    try:
+        head = read_head(conn)
     except Exception as e:
-        logging.error(f"Socket connection failed: {e}")
+        conn.reusable = False
+        logging.info(f"No answer to the pipelined request: {e}")
+        return None
+    finally:
+        conn.sock.settimeout(None)
+    if head is None:
         return None
+    return read_response(conn, head)
 
 
-def process_chunked_body(data):#used for processing chunk transfer encoding and to return the whole html body
-    full_body = b""
-    idx = 0
+def check_status(status_code, body):#returns the body for a 200 response, logs and returns None otherwise
+    #to handle non-200 status codes (e.g., 404, too many redirects)
+    if status_code == 404:
+        logging.error("404 Not Found")
+        return None
 
-    while idx < len(data):
-        # Locate the end of the chunk size line
-        end_of_size = data.find(b"\r\n", idx)
-        if end_of_size == -1:
-            logging.error("Error: Missing chunk size CRLF.")
-            return full_body
+    if status_code != 200:
+        logging.error(f"Received non-200 status code: {status_code}")
+        return None
 
-        #extracting the chunk size
-        chunk_size_str = data[idx:end_of_size].strip()
-        try:
-            chunk_size = int(chunk_size_str, 16)
-        except ValueError:
-            logging.error("Error: Invalid chunk size.")
-            return full_body
+    return body
 
-        if chunk_size == 0:
-            break  #end of chunks
-        idx = end_of_size + 2  # Skip the CRLF after the size
 
-        chunk_data = data[idx:idx + chunk_size] #adding the current chunk to the whole body
-        full_body += chunk_data
+def read_body(conn, headers):#reads exactly one body, BodyStream knows where it ends (chunked encoding, Content-Length or the server closing)
+    stream = BodyStream(conn, headers)
+    body = bytearray() #whole chunks are copied straight from the receive buffer into this, no per-chunk bytes objects
+    read_into = stream.read_into #binding the method once, this loop runs for every chunk
+    while read_into(body):
+        pass
+    return bytes(body)
 
-        idx += chunk_size + 2
 
-    return full_body
+def parse_headers(raw_headers):#parses the status line and all headers in one pass, header names are lowercased
+    lines = raw_headers.split(b"\r\n")
+    status_code = int(lines[0].split(None, 2)[1])
 
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(b":")
+        if not sep:
+            continue
+        name = name.strip().lower()
+        value = value.strip()
+        if name in headers:
+            value = headers[name] + b", " + value #repeated headers are combined like the RFC says
+        headers[name] = value
+    return status_code, headers
 
 
-def clean_response(response):#used for cleaning the response by removing dynamic elements
-    cleaned_response = response.replace(b"session_id=", b"").replace(b"timestamp=", b"")#removing timestamps and session ids
-    return cleaned_response
+def read_chunk_size(reader):#reads the next chunk size line, raises ConnectionError if it is missing or invalid
+    #reading the chunk size line out of the buffer
+    size_line = reader.read_until(b"\r\n")
+    if size_line is None:
+        reader.reusable = False
+        raise ConnectionError("Connection closed before the next chunk size")
 
+    #extracting the chunk size, ignoring any chunk extensions (int() already skips the whitespace)
+    try:
+        return int(size_line.partition(b";")[0], 16)
+    except ValueError:
+        reader.reusable = False
+        raise ConnectionError(f"Invalid chunk size line: {size_line[:20]!r}")
+
+
+class BodyStream:#file-like reader over one response body, so gzip can decompress it while it is still arriving
+    def __init__(self, conn, headers):
+        self.conn = conn
+        self.chunked = b"chunked" in headers.get(b"transfer-encoding", b"").lower()
+        self.done = False
+
+        content_length = headers.get(b"content-length", b"")
+        if self.chunked:
+            self.remaining = 0 #bytes left in the current chunk
+        elif content_length.isdigit():
+            self.remaining = int(content_length)
+            self.done = self.remaining == 0
+        else:
+            self.remaining = None #no length given, the body ends when the server closes the connection
+            conn.reusable = False
+
+    def next_part(self):#moves on to the next chunk once the current one is used up, returns False once the body has ended
+        if self.done:
+            return False
+        if self.chunked and self.remaining == 0:
+            self.remaining = read_chunk_size(self.conn)
+            if self.remaining == 0:
+                #skipping the optional trailer headers up to the final empty line
+                while self.conn.read_until(b"\r\n"):
+                    pass
+                self.done = True
+                return False
+        return True
+
+    def consumed(self, size):#counts size bytes of the current chunk (or body) as read
+        self.remaining -= size
+        if self.remaining == 0:
+            if self.chunked:
+                self.conn.skip(2) # Skip the CRLF after the chunk data
+            else:
+                self.done = True
+
+    def read(self, size=BUFFER_SIZE):#returns up to size bytes of the body, b"" once it has all been read
+        if not self.next_part():
+            return b""
+
+        if self.remaining is None:
+            data = self.conn.read_some(size)
+            self.done = not data
+            return data
+
+        data = self.conn.read(min(size, self.remaining))
+        if not data:
+            raise ConnectionError("Connection closed before the whole body was received")
+        self.consumed(len(data))
+        return data
+
+    def read_into(self, out):#appends the rest of the current chunk (or of the whole body) to the bytearray out, returns False once the body has ended
+        if not self.next_part():
+            return False
+
+        if self.remaining is None:
+            out += self.conn.read_all()
+            self.done = True
+            return True
+
+        if not self.conn.read_into(out, self.remaining):
+            self.conn.reusable = False
+            raise ConnectionError("Connection closed before the whole body was received")
+        self.consumed(self.remaining)
+        return True
+
+    def drain(self):#reads whatever gzip left unread, so the connection ends up right after this body
+        while self.read():
+            pass
+
+
+class SocketReader:#buffered reader on top of the socket, lines are searched in our own buffer instead of reading byte by byte
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address #(scheme, host, port) the connection was opened for
+        self.buffer = bytearray()
+        self.reusable = True #becomes False once the server closes or asks us to close the connection
+        self.chunk = memoryview(bytearray(BUFFER_SIZE)) #one receive buffer reused by every recv_into
+        self.slow = False #set when the first response took longer than PIPELINE_TIMEOUT
+        self.quickack = TCP_QUICKACK is not None and sock.family in (socket.AF_INET, socket.AF_INET6) #TCP sockets only
+
+    def close(self):
+        self.reusable = False
+        if isinstance(self.sock, ssl.SSLSocket) and self.sock.session is not None:
+            if self.address not in _TLS_SESSIONS and len(_TLS_SESSIONS) >= TLS_SESSION_CACHE_SIZE:
+                _TLS_SESSIONS.clear()
+            _TLS_SESSIONS[self.address] = self.sock.session #saved at close, TLS 1.3 tickets only arrive after the handshake
+        self.sock.close()
+
+    def receive(self, size):#receives up to size bytes into self.chunk and returns how many arrived
+        received = self.sock.recv_into(self.chunk, size)
+        if received and self.quickack:
+            self.sock.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+        return received
+
+    def fill(self):#reads the next block from the socket, returns False once the server closed the connection
+        received = self.receive(BUFFER_SIZE)
+        if not received:
+            return False
+        self.buffer += self.chunk[:received]
+        return True
+
+    def read_until(self, delimiter):#returns the data before the delimiter, or None if the connection closed first
+        start = 0
+        while True:
+            end = self.buffer.find(delimiter, start)
+            if end != -1:
+                data = bytes(self.buffer[:end])
+                del self.buffer[:end + len(delimiter)]
+                return data
+            start = max(len(self.buffer) - len(delimiter) + 1, 0) #no need to search the old data again
+            if not self.fill():
+                return None
 
+    def read(self, size):#returns exactly size bytes, or whatever is left if the connection closed first
+        if len(self.buffer) >= size:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+        #taking over what is already buffered, then receiving the rest, so the result only grows as data actually arrives
+        data = self.buffer
+        self.buffer = bytearray()
+        while len(data) < size:
+            received = self.receive(min(BUFFER_SIZE, size - len(data))) #never reading past this body
+            if not received:
+                self.reusable = False
+                break
+            data += self.chunk[:received]
+        return bytes(data) #one conversion at the end, callers always get bytes whatever the size
+
+    def read_into(self, out, size):#appends the next size bytes to the bytearray out, returns False if the connection closed first
+        while size:
+            if not self.buffer and not self.fill():
+                return False
+            take = min(size, len(self.buffer))
+            view = memoryview(self.buffer) #copying through a view, so the slice isn't copied twice
+            out += view[:take]
+            view.release()
+            del self.buffer[:take]
+            size -= take
+        return True
+
+    def read_some(self, size):#returns up to size bytes, receiving only if nothing is buffered, b"" once the connection closed
+        if not self.buffer and not self.fill():
+            return b""
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def skip(self, size):#drops the next size bytes without copying them out
+        while len(self.buffer) < size:
+            if not self.fill():
+                break
+        del self.buffer[:size]
+
+    def read_all(self):#reads everything until the server closes the connection
+        while self.fill():
+            pass
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
 
+
+
+def clean_response(response):#used for cleaning the response by removing dynamic elements (session ids and timestamps with their values)
+    view = memoryview(response) #slices of the view don't copy, the join at the end copies each kept byte once
+    parts = []
+    idx = 0
+    next_pos = {key: response.find(key) for key in DYNAMIC_KEYS}
+    delimiters = None #built on the first key, so responses without dynamic keys are never copied
+
+    while True:
+        #picking the nearest dynamic key, each key is only searched again once we are past its last match
+        pos, key = -1, None
+        for candidate, found in next_pos.items():
+            if found != -1 and (pos == -1 or found < pos):
+                pos, key = found, candidate
+        if key is None:
+            break
+        parts.append(view[idx:pos])
+
+        #the value runs until the next delimiter, found with one search in a copy where every delimiter is the same byte
+        if delimiters is None:
+            delimiters = response.translate(DELIMITER_TABLE)
+        idx = delimiters.find(b"\n", pos + len(key))
+        if idx == -1:
+            idx = len(response)
+
+        for other, found in next_pos.items():
+            if found != -1 and found < idx:
+                next_pos[other] = response.find(other, idx)
+
+    parts.append(view[idx:])
+    return b"".join(parts)
+
+
+def fingerprint(response):#hash of the cleaned response, so only one cleaned copy is alive at a time when comparing
+    return hash(clean_response(response)) #bytes use SipHash, which is stable for the lifetime of the process